@@ -16,4 +16,4 @@ def read_latest_openapi_document(
     if latest_doc is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No OpenAPI document found for this project.")
     
-    return latest_doc.openapi_spec
+    return crud_openapi_doc.read_openapi_spec(latest_doc)
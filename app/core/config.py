@@ -10,6 +10,8 @@ class Settings(BaseSettings):
 
     # Code RAG service settings
     CODE_RAG_SERVICE_URL: str = Field("http://localhost:8002/v1/code-rag", env="CODE_RAG_SERVICE_URL")
+    # Maximum number of concurrent Code RAG calls per description generation
+    CODE_RAG_MAX_CONCURRENCY: int = Field(4, env="CODE_RAG_MAX_CONCURRENCY")
 
     model_config = {
         "env_file": ".env",
@@ -0,0 +1,42 @@
+from typing import Optional
+
+import httpx
+
+# Default timeout for outbound requests; callers with longer-running calls pass their own per request
+DEFAULT_TIMEOUT_SECONDS = 20
+
+# HTTP/2 needs the optional h2 package (installed via httpx[http2]); fall back to HTTP/1.1 without it
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# 所有外部HTTP调用（抓取OpenAPI源、Code-RAG服务）共用一个AsyncClient，共享连接池、keep-alive和TLS上下文
+_async_client: Optional[httpx.AsyncClient] = None
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Returns the application-wide HTTP client, creating it on first use.
+    """
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            timeout=DEFAULT_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+            # Spec endpoints are often behind a redirect (e.g. /v3/api-docs -> /v3/api-docs/);
+            # follow it on the pooled connection instead of failing the fetch
+            follow_redirects=True,
+            # Multiplex requests to the same origin over one connection when the server supports it
+            http2=HTTP2_AVAILABLE
+        )
+    return _async_client
+
+async def close_async_client() -> None:
+    """
+    Closes the shared HTTP client. Called on application shutdown.
+    """
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
@@ -1,19 +1,47 @@
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 
+import orjson
+import zstandard
 from sqlalchemy.orm import Session
 
 from ..models.openapi_doc import OpenAPIDoc
 
 
-def create_openapi_doc(db: Session, project_id: int, task_id: int, openapi_spec: Dict[str, Any]) -> OpenAPIDoc:
+ZSTD_COMPRESSION_LEVEL = 3
+
+def _compress_spec(openapi_spec: Dict[str, Any]) -> bytes:
+    # Compressor objects must not be shared between threads, and the crud calls run in worker threads
+    return zstandard.ZstdCompressor(level=ZSTD_COMPRESSION_LEVEL).compress(orjson.dumps(openapi_spec))
+
+def _decode_spec(openapi_spec: Optional[Dict[str, Any]], openapi_spec_zstd: Optional[bytes]) -> Optional[Dict[str, Any]]:
+    # Rows written before the compressed column existed only have the JSON column
+    if openapi_spec_zstd is not None:
+        return orjson.loads(zstandard.ZstdDecompressor().decompress(openapi_spec_zstd))
+    return openapi_spec
+
+def read_openapi_spec(db_doc: OpenAPIDoc) -> Optional[Dict[str, Any]]:
+    return _decode_spec(db_doc.openapi_spec, db_doc.openapi_spec_zstd)
+
+def create_openapi_doc(db: Session, project_id: int, task_id: int, openapi_spec: Dict[str, Any],
+                       descriptions_index: Optional[List[List[Any]]] = None,
+                       source_etag: Optional[str] = None, source_last_modified: Optional[str] = None,
+                       source_sha256: Optional[str] = None, commit: bool = True) -> OpenAPIDoc:
+    # commit=False only flushes, leaving the commit to the caller's transaction
     db_doc = OpenAPIDoc(
         project_id=project_id,
         task_id=task_id,
-        openapi_spec=openapi_spec
+        openapi_spec_zstd=_compress_spec(openapi_spec),
+        descriptions_index=descriptions_index,
+        source_etag=source_etag,
+        source_last_modified=source_last_modified,
+        source_sha256=source_sha256
     )
     db.add(db_doc)
-    db.commit()
-    db.refresh(db_doc)
+    if commit:
+        db.commit()
+        db.refresh(db_doc)
+    else:
+        db.flush()
     return db_doc
 
 def get_latest_openapi_doc_by_project_id(db: Session, project_id: int) -> Optional[OpenAPIDoc]:
@@ -28,5 +56,31 @@ def get_latest_openapi_doc_by_project_id(db: Session, project_id: int) -> Option
     # Then get the full record by ID
     return db.query(OpenAPIDoc).filter(OpenAPIDoc.id == latest_id_result[0]).first()
 
+def get_openapi_spec_by_doc_id(db: Session, doc_id: int) -> Optional[Dict[str, Any]]:
+    # Spec columns only: returns the stored spec without building an OpenAPIDoc instance
+    result = db.query(OpenAPIDoc.openapi_spec, OpenAPIDoc.openapi_spec_zstd).filter(OpenAPIDoc.id == doc_id).first()
+
+    return _decode_spec(result[0], result[1]) if result else None
+
+def get_descriptions_index_by_doc_id(db: Session, doc_id: int) -> Optional[List[List[Any]]]:
+    # Only load the small index column, not the full JSON spec
+    result = db.query(OpenAPIDoc.descriptions_index).filter(OpenAPIDoc.id == doc_id).first()
+
+    return result[0] if result else None
+
+def get_latest_source_state_by_project_id(db: Session, project_id: int
+                                          ) -> Tuple[Optional[int], Optional[Tuple[Optional[str], Optional[str]]], Optional[str]]:
+    # (doc id, (ETag, Last-Modified), SHA-256) of the latest doc and the source it was generated from;
+    # the validators are None if it had neither. Callers load that doc's spec by the returned id,
+    # so the source state and the spec always describe the same doc.
+    result = db.query(OpenAPIDoc.id, OpenAPIDoc.source_etag, OpenAPIDoc.source_last_modified, OpenAPIDoc.source_sha256).filter(
+        OpenAPIDoc.project_id == project_id
+    ).order_by(OpenAPIDoc.created_at.desc()).first()
+
+    if not result:
+        return None, None, None
+    validators = None if result[1] is None and result[2] is None else (result[1], result[2])
+    return result[0], validators, result[3]
+
 def get_openapi_doc_by_task_id(db: Session, task_id: int) -> Optional[OpenAPIDoc]:
     return db.query(OpenAPIDoc).filter(OpenAPIDoc.task_id == task_id).first()
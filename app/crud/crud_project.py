@@ -1,17 +1,49 @@
 from typing import Optional, List
 
 from fastapi import HTTPException, status
-from sqlalchemy.exc import OperationalError  # Added
+from sqlalchemy.exc import IntegrityError, OperationalError  # Added
 from sqlalchemy.orm import Session
 
+from ..core.security import hash_token
 from ..models.project import Project, ProjectStatusEnum  # Updated import
 from ..schemas.project import ProjectBase, ProjectUpdate
 
+# Attempt to import psycopg2 errors for specific lock checking. Probed once at import time:
+# a failed import is not cached in sys.modules and would search sys.path again on every call.
+try:
+    import psycopg2.errors
+    LockNotAvailable = psycopg2.errors.LockNotAvailable
+except ImportError:
+    LockNotAvailable = None # Fallback if psycopg2 is not available or not the driver
+
 
 # Custom exception for lock errors
 class ProjectLockedError(Exception):
     pass
 
+# Unique index created for Project.name (unique=True, index=True), MySQL's duplicate-key error
+# code and PostgreSQL's unique_violation SQLSTATE
+PROJECT_NAME_UNIQUE_INDEX = "ix_projects_name"
+MYSQL_DUPLICATE_ENTRY_ERRNO = 1062
+POSTGRES_UNIQUE_VIOLATION = "23505"
+
+def _is_duplicate_project_name(e: IntegrityError) -> bool:
+    """
+    Tells whether an IntegrityError was raised by the unique constraint on projects.name,
+    rather than by any other constraint on the row.
+    """
+    message = str(e.orig)
+    if getattr(e.orig, "errno", None) == MYSQL_DUPLICATE_ENTRY_ERRNO:
+        # e.g. "Duplicate entry 'x' for key 'projects.ix_projects_name'"
+        return PROJECT_NAME_UNIQUE_INDEX in message
+    if getattr(e.orig, "pgcode", None) == POSTGRES_UNIQUE_VIOLATION:
+        # e.g. 'duplicate key value violates unique constraint "ix_projects_name"'
+        diag = getattr(e.orig, "diag", None)
+        constraint_name = getattr(diag, "constraint_name", None)
+        return PROJECT_NAME_UNIQUE_INDEX in (constraint_name or message)
+    # SQLite has no error code for this and names the failing column instead
+    return "UNIQUE constraint failed: projects.name" in message
+
 def get_project(db: Session, project_id: int) -> Optional[Project]:
     """
     Retrieves a project by its ID.
@@ -24,13 +56,6 @@ def get_project_for_update(db: Session, project_id: int) -> Optional[Project]:
     Raises ProjectLockedError if the row is locked.
     """
     try:
-        # Attempt to import psycopg2 errors for specific lock checking
-        try:
-            import psycopg2.errors
-            LockNotAvailable = psycopg2.errors.LockNotAvailable
-        except ImportError:
-            LockNotAvailable = None # Fallback if psycopg2 is not available or not the driver
-
         db_project = db.query(Project).filter(Project.id == project_id).with_for_update(nowait=True).first()
         return db_project
     except OperationalError as e:
@@ -67,18 +92,11 @@ def create_project(db: Session, project: ProjectBase, apikey: str) -> Project:
     Creates a new project.
     - Before saving git_auth_token and custom_api_token, add a comment placeholder like # TODO: Encrypt token before saving.
     - Check if a project with the same name already exists; if so, raise an HTTPException (status_code 400).
+      The unique constraint on projects.name does the check as part of the INSERT, so no lookup runs first;
+      any other integrity error is re-raised as is.
     """
-    db_project_by_name = get_project_by_name(db, name=project.name)
-    if db_project_by_name:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Project with name '{project.name}' already exists.",
-        )
-
     # TODO: Encrypt token before saving (for git_auth_token) - This is for Bella's access to user's repo
 
-    from ..core.security import hash_token
-    
     # Hash the provided bearer_token for storing
     hashed_bearer_token = hash_token(apikey)
 
@@ -93,7 +111,16 @@ def create_project(db: Session, project: ProjectBase, apikey: str) -> Project:
         status=ProjectStatusEnum.init # Default status on creation
     )
     db.add(db_project)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        if not _is_duplicate_project_name(e):
+            raise
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Project with name '{project.name}' already exists.",
+        ) from e
     db.refresh(db_project)
     return db_project
 
@@ -107,7 +134,6 @@ def update_project(db: Session, project_id: int, project_update: ProjectUpdate)
         return None
 
     update_data = project_update.dict(exclude_unset=True) 
-    from ..core.security import hash_token # Import for hashing
 
     for field_name, value in update_data.items():
         if field_name == "bearer_token" and value is not None:
@@ -135,9 +161,10 @@ def delete_project(db: Session, project_id: int) -> Optional[Project]:
     db.commit()
     return db_project
 
-def update_project_status(db: Session, project_id: int, status: ProjectStatusEnum) -> Optional[Project]: # Updated enum type
+def update_project_status(db: Session, project_id: int, status: ProjectStatusEnum, commit: bool = True) -> Optional[Project]: # Updated enum type
     """
     Updates the status of a project.
+    With commit=False the change is only flushed and the caller's transaction commits it.
     """
     db_project = get_project(db, project_id=project_id)
     if not db_project:
@@ -145,6 +172,18 @@ def update_project_status(db: Session, project_id: int, status: ProjectStatusEnu
     
     db_project.status = status
     db.add(db_project)
-    db.commit()
-    db.refresh(db_project)
+    if commit:
+        db.commit()
+        db.refresh(db_project)
+    else:
+        db.flush()
+    return db_project
+
+def set_loaded_project_status(db: Session, db_project: Project, status: ProjectStatusEnum) -> Project:
+    """
+    Updates the status of a project row already loaded in this session, e.g. one locked with
+    get_project_for_update, without selecting it again. Only flushes; the caller's transaction commits it.
+    """
+    db_project.status = status
+    db.flush()
     return db_project
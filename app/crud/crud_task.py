@@ -26,8 +26,10 @@ def update_task_status(
     task_id: int, 
     status: TaskStatusEnum, 
     result: Optional[str] = None, 
-    error_message: Optional[str] = None
+    error_message: Optional[str] = None,
+    commit: bool = True
 ) -> Optional[Task]:
+    # commit=False only flushes, leaving the commit to the caller's transaction
     db_task = get_task(db, task_id)
     if db_task:
         db_task.status = status
@@ -36,6 +38,9 @@ def update_task_status(
         if error_message is not None:
             db_task.error_message = error_message
         db.add(db_task) # Use add for existing objects too, SQLAlchemy handles it
-        db.commit()
-        db.refresh(db_task)
+        if commit:
+            db.commit()
+            db.refresh(db_task)
+        else:
+            db.flush()
     return db_task
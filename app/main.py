@@ -4,6 +4,7 @@ from fastapi import FastAPI
 
 from .api.api_router import api_router  # Import the main API router
 from .core.database import engine, init_db  # Import engine and init_db
+from .core.http import close_async_client
 
 # Configure basic logging
 logging.basicConfig(level=logging.INFO)
@@ -25,6 +26,11 @@ app = FastAPI(
 # Include the main API router
 app.include_router(api_router, prefix="/v1/api-doc") # Prefix all API routes with /v1/api-doc
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Release pooled connections held by the shared HTTP client
+    await close_async_client()
+
 @app.get("/health", tags=["Health"])
 async def health_check():
     return {"status": "ok", "message": "Application is healthy."}
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, DateTime, func, JSON
+from sqlalchemy import Column, Integer, String, DateTime, func, JSON, LargeBinary
+from sqlalchemy.dialects.mysql import LONGBLOB
 
 from .project import Base  # Assuming Base is in project.py or a shared models.base
 
@@ -14,7 +15,20 @@ class OpenAPIDoc(Base):
     # otherwise TEXT and handle JSON conversion in application code.
     # Using JSON type if available, fallback to TEXT.
     # For SQLite, JSON type is often emulated as TEXT.
-    openapi_spec = Column(JSON, nullable=False) 
+    # Legacy storage; new rows leave it NULL and store the spec in openapi_spec_zstd instead.
+    openapi_spec = Column(JSON, nullable=True)
+    # orjson-encoded spec compressed with zstd: several times smaller than the JSON column,
+    # so large specs cost less to transfer from the DB and to decode.
+    openapi_spec_zstd = Column(LargeBinary().with_variant(LONGBLOB(), "mysql"), nullable=True)
+    # Flat list of [kind, path segments, description] extracted from openapi_spec at insert time,
+    # so the next generation can merge descriptions without walking the whole stored spec.
+    descriptions_index = Column(JSON, nullable=True)
+    # Validators the source spec was served with; the next generation sends them as a conditional
+    # GET and reuses this doc when the source answers 304 Not Modified.
+    source_etag = Column(String(255), nullable=True)
+    source_last_modified = Column(String(64), nullable=True)
+    # SHA-256 of the raw source spec body; reused like the validators when the source sends none
+    source_sha256 = Column(String(64), nullable=True)
     created_at = Column(DateTime, default=func.now(), index=True)
 
     def __repr__(self):
@@ -1,11 +1,15 @@
 import httpx
 import logging
 import json
+import orjson
 import time
 import asyncio
+import random
+from functools import lru_cache
 from typing import Optional, Dict, Any
 
 from app.core.config import settings
+from app.core.http import get_async_client
 
 logger = logging.getLogger(__name__)
 
@@ -55,17 +59,17 @@ async def setup_code_rag_repository(
         headers["Authorization"] = f"Bearer {apikey}"
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(setup_url, json=payload, headers=headers, timeout=1800) # Long timeout
-
-            if response.status_code in [200, 201, 202]: # Check for successful status codes including 202 Accepted
-                response_data = response.json()
-                logger.info(f"Successfully initiated Code-RAG repository setup for project '{project_name}'. Status: {response.status_code}.")
-                return response_data  # Return the task ID and other info from response
-            else:
-                error_detail = response.text[:500] # Limit error detail length
-                logger.error(f"Failed to set up Code-RAG repository for project '{project_name}'. Status: {response.status_code}. Response: {error_detail}")
-                return {"error": f"Failed with status code: {response.status_code}", "details": error_detail}
+        client = get_async_client()
+        response = await client.post(setup_url, json=payload, headers=headers, timeout=1800) # Long timeout
+
+        if response.status_code in [200, 201, 202]: # Check for successful status codes including 202 Accepted
+            response_data = response.json()
+            logger.info(f"Successfully initiated Code-RAG repository setup for project '{project_name}'. Status: {response.status_code}.")
+            return response_data  # Return the task ID and other info from response
+        else:
+            error_detail = response.text[:500] # Limit error detail length
+            logger.error(f"Failed to set up Code-RAG repository for project '{project_name}'. Status: {response.status_code}. Response: {error_detail}")
+            return {"error": f"Failed with status code: {response.status_code}", "details": error_detail}
 
     except httpx.TimeoutException:
         error_msg = f"Timeout occurred while calling Code-RAG setup for project '{project_name}' at {setup_url}"
@@ -113,17 +117,17 @@ async def check_code_rag_repository_status(
         headers["Authorization"] = f"Bearer {apikey}"
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(status_url, headers=headers, timeout=60)
-
-            if response.status_code == 200:
-                status_data = response.json()
-                logger.info(f"Successfully retrieved status for Code-RAG repository '{repo_id}': {status_data.get('status')}")
-                return status_data
-            else:
-                error_detail = response.text[:500] # Limit error detail length
-                logger.error(f"Failed to check status of Code-RAG repository '{repo_id}'. Status: {response.status_code}. Response: {error_detail}")
-                return {"error": f"Failed with status code: {response.status_code}", "details": error_detail}
+        client = get_async_client()
+        response = await client.get(status_url, headers=headers, timeout=60)
+
+        if response.status_code == 200:
+            status_data = response.json()
+            logger.info(f"Successfully retrieved status for Code-RAG repository '{repo_id}': {status_data.get('status')}")
+            return status_data
+        else:
+            error_detail = response.text[:500] # Limit error detail length
+            logger.error(f"Failed to check status of Code-RAG repository '{repo_id}'. Status: {response.status_code}. Response: {error_detail}")
+            return {"error": f"Failed with status code: {response.status_code}", "details": error_detail}
 
     except httpx.TimeoutException:
         error_msg = f"Timeout occurred while checking status of Code-RAG repository '{repo_id}'"
@@ -139,6 +143,9 @@ async def check_code_rag_repository_status(
         return {"error": "UnexpectedError", "details": error_msg}
 
 
+# 轮询间隔的随机抖动比例，实际间隔在[interval, interval * (1 + 比例)]之间
+POLLING_JITTER_RATIO = 0.1
+
 async def setup_code_rag_repository_and_wait(
     project_name: str,
     git_repo_url: str,
@@ -147,7 +154,8 @@ async def setup_code_rag_repository_and_wait(
     force_reclone: bool = False,
     force_reindex: bool = False,
     max_wait_time: int = 1800,  # 默认最长等待30分钟
-    polling_interval: int = 10   # 默认每10秒检查一次状态
+    polling_interval: float = 30,  # 轮询间隔上限，默认30秒
+    initial_polling_interval: float = 1  # 首次轮询间隔，之后每次翻倍直到上限
 ) -> Dict[str, Any]:
     """
     设置代码仓库并等待其完成索引过程。
@@ -160,7 +168,8 @@ async def setup_code_rag_repository_and_wait(
         force_reclone: 是否强制重新克隆仓库
         force_reindex: 是否强制重新索引仓库
         max_wait_time: 最大等待时间（秒）
-        polling_interval: 轮询间隔（秒）
+        polling_interval: 轮询间隔上限（秒）
+        initial_polling_interval: 首次轮询间隔（秒），之后按指数退避翻倍，不超过polling_interval
         
     Returns:
         包含设置结果的字典，成功时status为completed，失败时会包含error字段
@@ -182,9 +191,11 @@ async def setup_code_rag_repository_and_wait(
     
     logger.info(f"代码仓库设置已启动，正在等待完成...")
     
-    # 轮询检查状态直到完成或超时
-    start_time = time.time()
-    while time.time() - start_time < max_wait_time:
+    # 轮询检查状态直到完成或超时；间隔从initial_polling_interval开始指数增长，
+    # 短任务能很快被发现完成，长任务的请求次数也不会随等待时间线性增长
+    deadline = time.monotonic() + max_wait_time
+    current_interval = min(initial_polling_interval, polling_interval)
+    while time.monotonic() < deadline:
         # 检查当前状态
         status_result = await check_code_rag_repository_status(
             repo_id=project_name,
@@ -207,13 +218,15 @@ async def setup_code_rag_repository_and_wait(
             logger.error(f"代码仓库设置失败: {status_result.get('message', '未知错误')}")
             return status_result
         
-        # 等待一段时间后再次检查
-        await asyncio.sleep(polling_interval)
+        # 等待一段时间后再次检查，不超过剩余的等待时间；加入随机抖动，避免多个同时启动的任务同步轮询
+        await asyncio.sleep(min(current_interval * random.uniform(1, 1 + POLLING_JITTER_RATIO), max(deadline - time.monotonic(), 0)))
+        current_interval = min(current_interval * 2, polling_interval)
     
     # 如果超时仍未完成
     logger.warning(f"等待代码仓库设置完成超时 (已等待 {max_wait_time} 秒)")
     return {"error": "Timeout", "details": f"代码仓库设置未能在 {max_wait_time} 秒内完成"}
 
+@lru_cache(maxsize=32)
 def _get_rewrite_prompt(language_hint: str) -> str:
     return f'''
     ## 你的角色:
@@ -265,6 +278,7 @@ def _get_rewrite_prompt(language_hint: str) -> str:
 请基于后续User Prompt中提供的OpenAPI JSON内容，遵循以上所有指令，生成检索查询。
     '''
 
+@lru_cache(maxsize=1)
 def _get_sys_prompt() -> str:
     return  """
     # OpenAPI 3.0 文档描述生成任务
@@ -355,12 +369,29 @@ def _get_sys_prompt() -> str:
 直接输出完整的OpenAPI 3.0 JSON文档，不要添加任何解释文字或markdown标记，否则会序列化报错。
     """
 
+QUERY_TEXT_PREFIX = "以下为openapi 3.0规范的json："
+
+# Maximum number of bytes read from a failed Code RAG response for logging
+ERROR_BODY_PREFIX_BYTES = 2048
+
+async def _read_body_prefix(response: httpx.Response, limit: int) -> str:
+    """
+    Reads at most `limit` bytes from a streamed response body and decodes them for logging.
+    The rest of the body is never pulled into memory.
+    """
+    buffer = bytearray()
+    async for chunk in response.aiter_bytes():
+        buffer.extend(chunk)
+        if len(buffer) >= limit:
+            break
+    return buffer[:limit].decode(response.encoding or "utf-8", errors="replace")
+
 async def call_code_rag(partial_openapi_spec: Dict[str, Any], repo_id: str, language: str, apikey: str) -> Optional[Dict[str, Any]]:
     """
     Calls the Code RAG to get contextually relevant code snippets.
     """
 
-    query_text = f"以下为openapi 3.0规范的json：{json.dumps(partial_openapi_spec, ensure_ascii=False)}"
+    query_text = QUERY_TEXT_PREFIX + json.dumps(partial_openapi_spec, ensure_ascii=False)
 
     payload = {
         "repo_id": repo_id,
@@ -374,44 +405,54 @@ async def call_code_rag(partial_openapi_spec: Dict[str, Any], repo_id: str, lang
         "Content-Type": "application/json"
     }
 
+    # Serialize once as UTF-8 and send the bytes as-is: the prompts and descriptions are Chinese,
+    # which older httpx versions would otherwise send as \uXXXX escapes
+    body = orjson.dumps(payload)
+
     logger.info(f"Calling Code RAG service for repo_id: {repo_id} with partial spec.")
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{settings.CODE_RAG_SERVICE_URL}/query/stream",
-                json=payload,
-                headers=headers,
-                timeout=300
-            )
-
-            if response.status_code == 200:
-                try:
-                    result = response.json()
-                    logger.info(f"Successfully received response from Code RAG service for repo_id: {repo_id}")
-                    return result
-                except json.JSONDecodeError:
-                    # Clean response text from potential markdown formatting
-                    response_text = response.text
-                    # Remove markdown code blocks (```json and ```)
-                    if "```json" in response_text:
-                        response_text = response_text.split("```json")[1].split("```")[0].strip()
-                    elif "```" in response_text:
-                        # Handle case where language isn't specified in the markdown
-                        code_blocks = response_text.split("```")
-                        if len(code_blocks) >= 3:  # At least one complete code block
-                            response_text = code_blocks[1].strip()
-
-                    # Try to parse the cleaned text as JSON
-                    try:
-                        result = json.loads(response_text)
-                        logger.info(f"Successfully received response from Code RAG service for repo_id: {repo_id}")
-                        return result
-                    except json.JSONDecodeError:
-                        logger.error(f"Failed to decode JSON response from Code RAG service for repo_id: {repo_id}. Response text: {response.text}")
-                        return None
-            else:
-                logger.error(f"Error calling Code RAG service for repo_id: {repo_id}. Status: {response.status_code}, Response: {response.text}")
+        client = get_async_client()
+        async with client.stream(
+            "POST",
+            f"{settings.CODE_RAG_SERVICE_URL}/query/stream",
+            content=body,
+            headers=headers,
+            timeout=300
+        ) as response:
+
+            if response.status_code != 200:
+                # Only a bounded prefix of the error body is needed for logging
+                error_detail = await _read_body_prefix(response, ERROR_BODY_PREFIX_BYTES)
+                logger.error(f"Error calling Code RAG service for repo_id: {repo_id}. Status: {response.status_code}, Response: {error_detail}")
+                return None
+
+            await response.aread()
+
+        try:
+            # Parse the raw bytes with orjson instead of decoding to str and using the json module
+            result = orjson.loads(response.content)
+            logger.info(f"Successfully received response from Code RAG service for repo_id: {repo_id}")
+            return result
+        except orjson.JSONDecodeError:
+            # Clean response text from potential markdown formatting
+            response_text = response.text
+            # Remove markdown code blocks (```json and ```)
+            if "```json" in response_text:
+                response_text = response_text.split("```json")[1].split("```")[0].strip()
+            elif "```" in response_text:
+                # Handle case where language isn't specified in the markdown
+                code_blocks = response_text.split("```")
+                if len(code_blocks) >= 3:  # At least one complete code block
+                    response_text = code_blocks[1].strip()
+
+            # Try to parse the cleaned text as JSON
+            try:
+                result = orjson.loads(response_text)
+                logger.info(f"Successfully received response from Code RAG service for repo_id: {repo_id}")
+                return result
+            except orjson.JSONDecodeError:
+                logger.error(f"Failed to decode JSON response from Code RAG service for repo_id: {repo_id}. Response text: {response.text}")
                 return None
 
     except httpx.TimeoutException:
@@ -1,32 +1,60 @@
+import asyncio
 import copy
+import json
 import logging
-from typing import Dict, Any, List, Set
+import re
+from collections import defaultdict
+from typing import DefaultDict, Dict, Any, FrozenSet, List, Optional, Set
 
 from .code_rag_service import call_code_rag
 
 logger = logging.getLogger(__name__)
 
+# Matches "$ref": "#/components/schemas/..." in JSON text. A quoted $ref appearing inside a
+# string value is escaped as \"$ref\" by the encoder and therefore never matches.
+_SCHEMA_REF_PATTERN = re.compile(r'"\$ref"\s*:\s*"#/components/schemas/([^"]+)"')
+
 def _extract_schema_references(element: Any, current_schemas: Set[str]) -> None:
     """
-    Recursively traverses an OpenAPI element and extracts schema references.
+    Extracts schema references from an OpenAPI element.
     A schema reference is a dict with a '$ref' key whose value starts with '#/components/schemas/'.
+    The element is serialized once and scanned with a compiled regex instead of being walked
+    node by node in Python.
+    """
+    for ref_path in _SCHEMA_REF_PATTERN.findall(json.dumps(element, ensure_ascii=False)):
+        current_schemas.add(ref_path.split('/')[-1])
+
+def _schema_references_for(element: Any, refs_cache: Dict[int, FrozenSet[str]]) -> FrozenSet[str]:
+    """
+    Returns the schema references of an OpenAPI element, scanning it at most once per object.
+    The cache is keyed by id() and must only live as long as the objects it describes.
     """
-    if isinstance(element, dict):
-        if '$ref' in element and isinstance(element['$ref'], str) and element['$ref'].startswith('#/components/schemas/'):
-            schema_name = element['$ref'].split('/')[-1]
-            current_schemas.add(schema_name)
-        for key, value in element.items():
-            _extract_schema_references(value, current_schemas)
-    elif isinstance(element, list):
-        for item in element:
-            _extract_schema_references(item, current_schemas)
+    key = id(element)
+    cached = refs_cache.get(key)
+    if cached is None:
+        refs: Set[str] = set()
+        _extract_schema_references(element, refs)
+        cached = frozenset(refs)
+        refs_cache[key] = cached
+    return cached
+
+def _current_subgroup(subgroups: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Returns the subgroup new paths should go into, starting a new one for the
+    first path of a prefix or when the last one already has 10 paths.
+    """
+    if not subgroups or len(subgroups[-1]['paths']) >= 10:
+        subgroups.append({'paths': {}, 'schema_names': set()})
+    return subgroups[-1]
 
 def group_openapi_paths(openapi_paths: Dict[str, Any], openapi_components_schemas: Dict[str, Any]) -> List[Dict[str, Any]]:
     """
     Groups OpenAPI paths by their prefix (e.g., /v1/users) and identifies all schemas
     referenced within each group. Each group contains at most 10 paths.
     """
-    groups: Dict[str, List[Dict[str, Any]]] = {}
+    groups: DefaultDict[str, List[Dict[str, Any]]] = defaultdict(list)
+    # Per-call cache so path items shared between several paths are only scanned once
+    refs_cache: Dict[int, FrozenSet[str]] = {}
 
     for path_string, path_item_object in openapi_paths.items():
         parts = path_string.strip('/').split('/')
@@ -40,26 +68,13 @@ def group_openapi_paths(openapi_paths: Dict[str, Any], openapi_components_schema
             # Default group for paths like "/" or if something is unexpected
             group_key = "/default_group"
 
-        if group_key not in groups:
-            groups[group_key] = []
-
-        # Check if we need to create a new subgroup (if the current one has 10 paths already)
-        current_group_idx = 0
-        if len(groups[group_key]) > 0:
-            current_group_idx = len(groups[group_key]) - 1
-            if len(groups[group_key][current_group_idx]['paths']) >= 10:
-                # Create a new subgroup
-                groups[group_key].append({'paths': {}, 'schema_names': set()})
-                current_group_idx += 1
-        else:
-            # First subgroup for this prefix
-            groups[group_key].append({'paths': {}, 'schema_names': set()})
+        current_subgroup = _current_subgroup(groups[group_key])
 
         # Add the path to the current subgroup
-        groups[group_key][current_group_idx]['paths'][path_string] = path_item_object
+        current_subgroup['paths'][path_string] = path_item_object
 
         # Extract schema references from the current path_item_object
-        _extract_schema_references(path_item_object, groups[group_key][current_group_idx]['schema_names'])
+        current_subgroup['schema_names'].update(_schema_references_for(path_item_object, refs_cache))
 
     # Convert groups dictionary to the desired list format
     result_list: List[Dict[str, Any]] = []
@@ -75,25 +90,38 @@ def group_openapi_paths(openapi_paths: Dict[str, Any], openapi_components_schema
 
     return result_list
 
-async def generate_descriptions(openapi_spec_source: Dict[str, Any], spec_diff_report: Dict[str, Any], repo_id: str, language: str, apikey: str) -> Dict[str, Any]:
+def _build_partial_spec(spec_version: str, spec_info: Dict[str, Any], paths: Dict[str, Any], schema_names: Set[str], schemas: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Builds the minimal OpenAPI document sent to the RAG service for one batch of paths,
+    containing only the schemas referenced by those paths; components is left out when
+    the batch references none. Only the enclosing containers are fresh; info, path items and schemas are shared
+    references, which is safe because the partial spec is only serialized, never mutated.
+    """
+    partial_spec = {
+        "openapi": spec_version,
+        "info": spec_info,
+        "paths": paths
+    }
+    relevant_schemas = {s_name: schemas[s_name] for s_name in schema_names if s_name in schemas}
+    if relevant_schemas:
+        partial_spec["components"] = {"schemas": relevant_schemas}
+    return partial_spec
+
+async def generate_descriptions(openapi_spec_source: Dict[str, Any], spec_diff_report: Dict[str, Any], repo_id: str, language: str, apikey: str,
+                                max_concurrency: int = 4) -> Dict[str, Any]:
     """
     Generates descriptions for added/modified paths in an OpenAPI specification
-    by calling a Code RAG service.
+    by calling a Code RAG service, with at most max_concurrency calls in flight.
     """
     # Logger is already initialized at the module level
     # global logger
 
     updated_spec = copy.deepcopy(openapi_spec_source)
-    paths_to_process: Dict[str, Any] = {}
-
-    for path_key, path_item in spec_diff_report.get('added_paths', {}).items():
-        paths_to_process[path_key] = path_item
-
-    for path_key, diff_item in spec_diff_report.get('modified_paths', {}).items():
-        if 'new' in diff_item: # 'new' contains the new path_item_object
-            paths_to_process[path_key] = diff_item['new']
-        else: # Fallback if 'new' is not present, though it should be for modified_paths
-            paths_to_process[path_key] = diff_item
+    # 'new' contains the new path_item_object; fall back to the item itself if it is missing
+    paths_to_process: Dict[str, Any] = {
+        **spec_diff_report.get('added_paths', {}),
+        **{path_key: diff_item.get('new', diff_item) for path_key, diff_item in spec_diff_report.get('modified_paths', {}).items()}
+    }
 
     if not paths_to_process:
         logger.info("No added or modified paths found in the diff report. No descriptions to generate.")
@@ -109,70 +137,61 @@ async def generate_descriptions(openapi_spec_source: Dict[str, Any], spec_diff_r
         logger.info("No path groups were formed from the paths_to_process. Nothing to send to RAG.")
         return updated_spec
 
-    batched_api_calls: List[Dict[str, Any]] = []
-    current_call_paths: Dict[str, Any] = {}
-    current_call_schema_names: Set[str] = set()
-
     # Ensure basic OpenAPI structure for partial_spec_for_rag
-    base_partial_spec = {
-        "openapi": updated_spec.get("openapi", "3.0.0"), # Default to 3.0.0 if not present
-        "info": updated_spec.get("info", {"title": "Partial API", "version": "1.0.0"}), # Provide default info
-        "paths": {},
-        "components": {"schemas": {}}
-    }
+    spec_version = updated_spec.get("openapi", "3.0.0") # Default to 3.0.0 if not present
+    spec_info = updated_spec.get("info", {"title": "Partial API", "version": "1.0.0"}) # Provide default info
 
-
-    for group in raw_groups:
-        current_call_paths.update(group.get('paths', {}))
-        current_call_schema_names.update(group.get('schema_names', set()))
-
-        partial_spec_for_rag = copy.deepcopy(base_partial_spec)
-        partial_spec_for_rag["paths"] = current_call_paths
-        # Filter only relevant schemas for the current batch
-        relevant_schemas = {s_name: schemas[s_name] for s_name in current_call_schema_names if s_name in schemas}
-        partial_spec_for_rag["components"]["schemas"] = relevant_schemas
-
-        batched_api_calls.append(partial_spec_for_rag)
-
-        current_call_paths = {}
-        current_call_schema_names = set()
-
-
-    # Add any remaining paths as the last batch
-    if current_call_paths:
-        partial_spec_for_rag = copy.deepcopy(base_partial_spec)
-        partial_spec_for_rag["paths"] = current_call_paths
-        relevant_schemas = {s_name: schemas[s_name] for s_name in current_call_schema_names if s_name in schemas}
-        partial_spec_for_rag["components"]["schemas"] = relevant_schemas
-        batched_api_calls.append(partial_spec_for_rag)
+    # One RAG call per path group
+    batched_api_calls: List[Dict[str, Any]] = [
+        _build_partial_spec(spec_version, spec_info, group.get('paths', {}), group.get('schema_names', set()), schemas)
+        for group in raw_groups
+    ]
 
     if not batched_api_calls:
         logger.info("No batches were created to call the RAG service.")
         return updated_spec
 
-    for partial_spec_input in batched_api_calls:
+    # Merge targets are resolved once instead of per successful batch; the schemas target is
+    # resolved on the first batch that returns schemas, so no empty components is added
+    merged_paths = updated_spec.setdefault('paths', {})
+    merged_schemas: Optional[Dict[str, Any]] = None
+
+    # Batches are independent RAG calls, so they run concurrently; the semaphore bounds how many
+    # are in flight at once so the Code-RAG service is not flooded on large diffs
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def process_batch(partial_spec_input: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         num_paths_in_batch = len(partial_spec_input.get('paths', {}))
         if num_paths_in_batch == 0:
             logger.info("Skipping an empty batch.")
-            continue
-
-        logger.info(f"Calling code-rag service for a batch of {num_paths_in_batch} paths.")
-
-        processed_chunk = await call_code_rag(partial_openapi_spec=partial_spec_input, repo_id=repo_id, language=language, apikey=apikey)
-
-        if processed_chunk:
-            logger.info(f"Successfully received processed chunk for {num_paths_in_batch} paths. Merging paths and schemas.")
+            return None
 
-            # Merge paths
-            if 'paths' in processed_chunk:
-                updated_spec.setdefault('paths', {}).update(processed_chunk['paths'])
+        async with semaphore:
+            logger.info(f"Calling code-rag service for a batch of {num_paths_in_batch} paths.")
+            processed_chunk = await call_code_rag(partial_openapi_spec=partial_spec_input, repo_id=repo_id, language=language, apikey=apikey)
 
-            # Merge schemas
-            if 'components' in processed_chunk and 'schemas' in processed_chunk['components']:
-                updated_spec.setdefault('components', {}).setdefault('schemas', {}).update(processed_chunk['components']['schemas'])
-        else:
+        if not processed_chunk:
             logger.warning(f"Failed to process a batch of {num_paths_in_batch} paths. Descriptions for this batch will be missing.")
             logger.error(f"Failed Json is {partial_spec_input}")
+        return processed_chunk
+
+    processed_chunks = await asyncio.gather(*(process_batch(partial_spec_input) for partial_spec_input in batched_api_calls))
 
+    # Results are merged in batch order, so the output does not depend on which call finished first
+    for partial_spec_input, processed_chunk in zip(batched_api_calls, processed_chunks):
+        if not processed_chunk:
+            continue
+        logger.info(f"Successfully received processed chunk for {len(partial_spec_input['paths'])} paths. Merging paths and schemas.")
+
+        # Merge paths
+        if 'paths' in processed_chunk:
+            merged_paths.update(processed_chunk['paths'])
+
+        # Merge schemas
+        processed_components = processed_chunk.get('components')
+        if processed_components and processed_components.get('schemas'):
+            if merged_schemas is None:
+                merged_schemas = updated_spec.setdefault('components', {}).setdefault('schemas', {})
+            merged_schemas.update(processed_components['schemas'])
 
     return updated_spec
@@ -1,9 +1,34 @@
 from typing import Optional, Dict, Any
 
+# All categories of a diff report, in report order
+DIFF_CATEGORIES = (
+    "added_paths",
+    "removed_paths",
+    "modified_paths",
+    "added_components_schemas",
+    "removed_components_schemas",
+    "modified_components_schemas",
+)
+
+# Diff categories whose top-level keys are also exposed as "<category>_keys" tuples,
+# so callers that only need the names don't have to walk the heavy dicts again
+_KEYED_CATEGORIES = (
+    "added_paths",
+    "modified_paths",
+    "added_components_schemas",
+    "modified_components_schemas",
+)
+
+def _with_key_fields(diff_report: Dict[str, Any]) -> Dict[str, Any]:
+    for category in _KEYED_CATEGORIES:
+        diff_report[f"{category}_keys"] = tuple(diff_report[category])
+    return diff_report
+
 def calculate_spec_diff(old_spec: Optional[Dict[str, Any]], new_spec: Dict[str, Any]) -> Dict[str, Any]:
     """
     Calculates a simplified diff between two OpenAPI specifications.
     Focuses on added, removed, and modified paths and component schemas.
+    Added and modified categories also get a "<category>_keys" tuple of their names.
     """
     diff_report: Dict[str, Any] = {
         "added_paths": {},
@@ -14,6 +39,10 @@ def calculate_spec_diff(old_spec: Optional[Dict[str, Any]], new_spec: Dict[str,
         "modified_components_schemas": {},
     }
 
+    # Same object on both sides: nothing can differ, skip the traversal
+    if old_spec is new_spec:
+        return _with_key_fields(diff_report)
+
     old_paths = old_spec.get("paths", {}) if old_spec else {}
     new_paths = new_spec.get("paths", {})
 
@@ -24,7 +53,7 @@ def calculate_spec_diff(old_spec: Optional[Dict[str, Any]], new_spec: Dict[str,
     if old_spec is None:
         diff_report["added_paths"] = new_paths
         diff_report["added_components_schemas"] = new_schemas
-        return diff_report
+        return _with_key_fields(diff_report)
 
     # Paths diffing
     for path, path_item in new_paths.items():
@@ -59,4 +88,10 @@ def calculate_spec_diff(old_spec: Optional[Dict[str, Any]], new_spec: Dict[str,
     # TODO: Implement more granular diff for schema properties.
     # TODO: Potentially extend to other components like parameters, responses etc.
 
-    return diff_report
+    return _with_key_fields(diff_report)
+
+def summarize_spec_diff(diff_report: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Returns the number of entries in each diff category, e.g. for logging.
+    """
+    return {category: len(diff_report[category]) for category in DIFF_CATEGORIES}
@@ -1,332 +1,803 @@
-import json
+import asyncio
+import hashlib
 import logging
-from typing import Optional, Dict, Any
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
 import httpx
+import orjson
 from sqlalchemy.exc import OperationalError
-from sqlalchemy.orm import Session
 
+from ..core.config import settings
 from ..core.database import get_session_scope
+from ..core.http import get_async_client
 from ..crud import crud_project, crud_task, crud_openapi_doc
 from ..crud.crud_project import ProjectLockedError
 from ..models.project import ProjectStatusEnum, Project as ProjectModel
 from ..models.task import TaskStatusEnum
 from .des_completion_service import generate_descriptions
 from .code_rag_service import setup_code_rag_repository_and_wait
-from .diff_service import calculate_spec_diff
-import copy
+from .diff_service import calculate_spec_diff, summarize_spec_diff
+from .git_service import get_remote_head_sha
 
 logger = logging.getLogger(__name__)
 
+# Static task results, serialized once instead of on every failure
+_ERR_PROJECT_LOCKED = '{"error": "Project is currently being processed by another request. Please try again later."}'
+_ERR_PROJECT_DB = '{"error": "A database error occurred while trying to access project details."}'
+_ERR_PROJECT_UNEXPECTED = '{"error": "An unexpected error occurred while retrieving project details."}'
+_ERR_PROJECT_NOT_FOUND = '{"error": "Project not found."}'
+_ERR_SOURCE_URL_MISSING = '{"error": "Source OpenAPI URL not configured"}'
+_ERR_FETCH_FAILED = '{"error": "Failed to fetch source OpenAPI spec"}'
+_ERR_CODE_RAG_SETUP_FAILED = '{"error": "Code-RAG setup failed."}'
+_RESULT_SUCCESS = '{"message": "OpenAPI documentation generated and stored successfully."}'
+# Only the exception text is encoded at failure time, the rest of the payload is fixed
+_ERR_UNEXPECTED_PREFIX = '{"error": "An unexpected server error occurred.", "details": '
+
+# merge_descriptions 遍历时的节点类型
+# 映射类节点：按key匹配两侧的子节点，子节点类型固定
+_MERGE_MAP_CHILD_KIND = {
+    'paths': 'path_item',
+    'path_item': 'operation',
+    'content': 'media_type',
+    'responses': 'response',
+    'schemas': 'schema',
+    'properties': 'property',
+}
+# 对象类节点：合并自身的description，并继续遍历下列子节点
+_MERGE_OBJECT_CHILDREN = {
+    'operation': (('requestBody', 'request_body'), ('responses', 'responses')),
+    'request_body': (('content', 'content'),),
+    'response': (('content', 'content'),),
+    'schema': (('properties', 'properties'),),
+    'media_type': (),
+    'property': (),
+}
+
 def merge_descriptions(previous_spec: Dict[str, Any], current_spec: Dict[str, Any]) -> Dict[str, Any]:
     """
     将previous_spec中的description字段合并到current_spec中
     保留结构变化，但保持原有的描述
+    使用显式栈迭代遍历两侧同时存在的节点，每个节点只索引一次
+    注意：直接修改并返回current_spec，previous_spec只读
     """
     if not previous_spec:
         return current_spec
+
+    # previous_spec中没有可合并的paths和schemas时直接返回
+    has_paths = bool(previous_spec.get('paths'))
+    has_schemas = bool((previous_spec.get('components') or {}).get('schemas'))
+    if not has_paths and not has_schemas:
+        return current_spec
         
-    result = copy.deepcopy(current_spec)
-    
+    result = current_spec
+
+    stack: List[Tuple[Dict[str, Any], Dict[str, Any], str]] = []
+
     # 合并paths中的description
-    if 'paths' in previous_spec and 'paths' in result:
-        for path_key, prev_path_item in previous_spec['paths'].items():
-            if path_key in result['paths']:
-                # 对于每个HTTP方法
-                for method, prev_operation in prev_path_item.items():
-                    if method in result['paths'][path_key]:
-                        # 如果之前有description但现在没有，则添加
-                        if 'description' in prev_operation and 'description' not in result['paths'][path_key][method]:
-                            result['paths'][path_key][method]['description'] = prev_operation['description']
-                        
-                        # 处理参数的description
-                        if 'parameters' in prev_operation and 'parameters' in result['paths'][path_key][method]:
-                            for i, param in enumerate(result['paths'][path_key][method]['parameters']):
-                                param_name = param.get('name')
-                                if param_name:
-                                    # 查找之前同名的参数
-                                    for prev_param in prev_operation['parameters']:
-                                        if prev_param.get('name') == param_name and 'description' in prev_param:
-                                            # 合并description
-                                            if 'description' not in param:
-                                                param['description'] = prev_param['description']
-                        
-                        # 合并requestBody中的description
-                        if 'requestBody' in prev_operation and 'requestBody' in result['paths'][path_key][method]:
-                            # 顶层requestBody描述
-                            if 'description' in prev_operation['requestBody'] and 'description' not in result['paths'][path_key][method]['requestBody']:
-                                result['paths'][path_key][method]['requestBody']['description'] = prev_operation['requestBody']['description']
-                            
-                            # requestBody中的内容描述
-                            if 'content' in prev_operation['requestBody'] and 'content' in result['paths'][path_key][method]['requestBody']:
-                                for content_type, prev_content in prev_operation['requestBody']['content'].items():
-                                    if content_type in result['paths'][path_key][method]['requestBody']['content']:
-                                        if 'description' in prev_content and 'description' not in result['paths'][path_key][method]['requestBody']['content'][content_type]:
-                                            result['paths'][path_key][method]['requestBody']['content'][content_type]['description'] = prev_content['description']
-                        
-                        # 合并responses中的description
-                        if 'responses' in prev_operation and 'responses' in result['paths'][path_key][method]:
-                            for status_code, prev_response in prev_operation['responses'].items():
-                                if status_code in result['paths'][path_key][method]['responses']:
-                                    # 响应描述
-                                    if 'description' in prev_response and ('description' not in result['paths'][path_key][method]['responses'][status_code] 
-                                                                        or result['paths'][path_key][method]['responses'][status_code]['description'] == 'OK'):
-                                        result['paths'][path_key][method]['responses'][status_code]['description'] = prev_response['description']
-                                    
-                                    # 响应内容描述
-                                    if 'content' in prev_response and 'content' in result['paths'][path_key][method]['responses'][status_code]:
-                                        for content_type, prev_content in prev_response['content'].items():
-                                            if content_type in result['paths'][path_key][method]['responses'][status_code]['content']:
-                                                if 'description' in prev_content and 'description' not in result['paths'][path_key][method]['responses'][status_code]['content'][content_type]:
-                                                    result['paths'][path_key][method]['responses'][status_code]['content'][content_type]['description'] = prev_content['description']
-    
+    if has_paths and 'paths' in result:
+        stack.append((previous_spec['paths'], result['paths'], 'paths'))
+
     # 合并components/schemas中的description
-    if 'components' in previous_spec and 'schemas' in previous_spec['components']:
-        result.setdefault('components', {}).setdefault('schemas', {})
-        
-        for schema_name, prev_schema in previous_spec['components']['schemas'].items():
-            if schema_name in result['components']['schemas']:
-                # 合并schema级别的description
-                if 'description' in prev_schema and 'description' not in result['components']['schemas'][schema_name]:
-                    result['components']['schemas'][schema_name]['description'] = prev_schema['description']
-                
-                # 合并属性级别的description
-                if 'properties' in prev_schema and 'properties' in result['components']['schemas'][schema_name]:
-                    for prop_name, prev_prop in prev_schema['properties'].items():
-                        if prop_name in result['components']['schemas'][schema_name]['properties']:
-                            # 如果之前有description但现在没有，则添加
-                            if 'description' in prev_prop and 'description' not in result['components']['schemas'][schema_name]['properties'][prop_name]:
-                                result['components']['schemas'][schema_name]['properties'][prop_name]['description'] = prev_prop['description']
+    if has_schemas:
+        result_schemas = result.setdefault('components', {}).setdefault('schemas', {})
+        stack.append((previous_spec['components']['schemas'], result_schemas, 'schemas'))
+
+    while stack:
+        prev_node, cur_node, kind = stack.pop()
+
+        child_kind = _MERGE_MAP_CHILD_KIND.get(kind)
+        if child_kind is not None:
+            for key, prev_child in prev_node.items():
+                cur_child = cur_node.get(key)
+                # path item中还可能有summary等非操作字段，只处理两侧都是对象的节点
+                if isinstance(prev_child, dict) and isinstance(cur_child, dict):
+                    stack.append((prev_child, cur_child, child_kind))
+            continue
+
+        # 如果之前有description但现在没有，则添加；响应的默认描述'OK'也会被覆盖
+        if 'description' in prev_node:
+            if kind == 'response' and cur_node.get('description') == 'OK':
+                cur_node['description'] = prev_node['description']
+            else:
+                cur_node.setdefault('description', prev_node['description'])
+
+        for key, child_kind in _MERGE_OBJECT_CHILDREN[kind]:
+            prev_child = prev_node.get(key)
+            cur_child = cur_node.get(key)
+            if isinstance(prev_child, dict) and isinstance(cur_child, dict):
+                stack.append((prev_child, cur_child, child_kind))
+
+        # 处理参数的description
+        if kind != 'operation':
+            continue
+        # 两侧的参数列表各取一次，循环中复用局部变量
+        prev_params = prev_node.get('parameters')
+        cur_params = cur_node.get('parameters')
+        if prev_params is not None and cur_params is not None:
+            # 按参数名建立之前参数的description索引，同名参数以第一个为准
+            prev_param_descriptions: Dict[str, Any] = {}
+            for prev_param in prev_params:
+                prev_param_name = prev_param.get('name')
+                if prev_param_name and 'description' in prev_param:
+                    prev_param_descriptions.setdefault(prev_param_name, prev_param['description'])
+            if prev_param_descriptions:
+                for param in cur_params:
+                    # 合并description
+                    param_name = param.get('name')
+                    if param_name in prev_param_descriptions:
+                        param.setdefault('description', prev_param_descriptions[param_name])
     
     return result
 
+def build_descriptions_index(spec: Dict[str, Any]) -> List[List[Any]]:
+    """
+    提取spec中merge_descriptions会合并的所有description，生成扁平索引
+    每一项为 [节点类型, 路径段列表, description]；参数以参数名作为'parameters'之后的路径段
+    在保存文档时生成一次，之后的合并只需线性遍历索引，不需要再遍历整个previous_spec
+    """
+    index: List[List[Any]] = []
+    stack: List[Tuple[Dict[str, Any], str, List[str]]] = []
+
+    paths = spec.get('paths')
+    if isinstance(paths, dict):
+        stack.append((paths, 'paths', ['paths']))
+    schemas = (spec.get('components') or {}).get('schemas')
+    if isinstance(schemas, dict):
+        stack.append((schemas, 'schemas', ['components', 'schemas']))
+
+    while stack:
+        node, kind, pointer = stack.pop()
+
+        child_kind = _MERGE_MAP_CHILD_KIND.get(kind)
+        if child_kind is not None:
+            for key, child in node.items():
+                if isinstance(child, dict):
+                    stack.append((child, child_kind, pointer + [key]))
+            continue
+
+        if 'description' in node:
+            index.append([kind, pointer, node['description']])
+
+        for key, child_kind in _MERGE_OBJECT_CHILDREN[kind]:
+            child = node.get(key)
+            if isinstance(child, dict):
+                stack.append((child, child_kind, pointer + [key]))
+
+        if kind == 'operation' and isinstance(node.get('parameters'), list):
+            for param in node['parameters']:
+                if isinstance(param, dict) and param.get('name') and 'description' in param:
+                    index.append(['parameter', pointer + ['parameters', param['name']], param['description']])
+
+    return index
+
+def apply_descriptions_index(current_spec: Dict[str, Any], descriptions_index: List[List[Any]]) -> Dict[str, Any]:
+    """
+    将build_descriptions_index生成的索引合并到current_spec中，规则与merge_descriptions一致
+    注意：直接修改并返回current_spec
+    """
+    # 每个参数列表只建立一次参数名索引；同名参数（如query和header中同名）全部保留，与merge_descriptions一样都会被填充
+    params_by_name: Dict[int, Dict[str, List[Dict[str, Any]]]] = {}
+
+    for kind, pointer, description in descriptions_index:
+        node: Any = current_spec
+        targets: Optional[List[Dict[str, Any]]] = None
+        for segment in pointer:
+            if isinstance(node, dict):
+                node = node.get(segment)
+            elif isinstance(node, list):
+                by_name = params_by_name.get(id(node))
+                if by_name is None:
+                    by_name = {}
+                    for param in node:
+                        if isinstance(param, dict) and param.get('name'):
+                            by_name.setdefault(param['name'], []).append(param)
+                    params_by_name[id(node)] = by_name
+                targets = by_name.get(segment)
+                node = None
+                break
+            else:
+                node = None
+            if node is None:
+                break
+
+        if targets is not None:
+            for param in targets:
+                param.setdefault('description', description)
+            continue
+        if not isinstance(node, dict):
+            continue
+        if kind == 'response' and node.get('description') == 'OK':
+            node['description'] = description
+        else:
+            node.setdefault('description', description)
+
+    return current_spec
+
 REQUEST_TIMEOUT_SECONDS = 20
 
-async def fetch_openapi_spec(openapi_api_url: str) -> Optional[Dict]:
+# Last successfully fetched spec body per URL with its validators: url -> (ETag, Last-Modified, body),
+# least recently used first. The raw body is cached rather than the parsed dict because callers
+# mutate the returned spec.
+SPEC_CACHE_SIZE = 32
+_spec_cache: "OrderedDict[str, Tuple[Optional[str], Optional[str], bytes]]" = OrderedDict()
+
+def _remember_spec_body(openapi_api_url: str, etag: Optional[str], last_modified: Optional[str], body: bytes) -> None:
+    _spec_cache[openapi_api_url] = (etag, last_modified, body)
+    _spec_cache.move_to_end(openapi_api_url)
+    while len(_spec_cache) > SPEC_CACHE_SIZE:
+        _spec_cache.popitem(last=False)
+
+# Returned by fetch_openapi_spec when the server confirms the source is unchanged since the
+# validators the caller passed in, i.e. the caller's existing result for that source is current
+SPEC_NOT_MODIFIED = object()
+
+async def _download_openapi_spec(openapi_api_url: str, known_validators: Optional[Tuple[Optional[str], Optional[str]]] = None
+                                 ) -> Tuple[Any, Optional[bytes], Tuple[Optional[str], Optional[str]]]:
+    """
+    Downloads and parses the OpenAPI specification from the given URL.
+    Returns the parsed spec together with its raw body and the (ETag, Last-Modified) it was served
+    with, or (None, None, (None, None)) if the request fails or the body is not valid JSON.
+    Any other error propagates to the orchestration's handler.
+    Uses a conditional GET (ETag / Last-Modified) so unchanged specs are not downloaded again.
+    If known_validators are given they are sent instead of the cached ones, and a 304 returns
+    (SPEC_NOT_MODIFIED, None, known_validators).
+    """
+    logger.info("Attempting to fetch OpenAPI spec from: %s", openapi_api_url)
+
+    request_headers = {}
+    cached = _spec_cache.get(openapi_api_url)
+    validators = known_validators or (cached[:2] if cached else None)
+    if validators:
+        etag, last_modified = validators
+        if etag:
+            request_headers["If-None-Match"] = etag
+        if last_modified:
+            request_headers["If-Modified-Since"] = last_modified
+
+    try:
+        # Stream the body into a single buffer instead of letting httpx keep both the
+        # chunk list and the joined content alive while the spec is parsed
+        async with get_async_client().stream("GET", openapi_api_url, headers=request_headers,
+                                             timeout=REQUEST_TIMEOUT_SECONDS) as response:
+            if response.status_code == 304 and known_validators:
+                logger.info("OpenAPI spec at %s not modified since the caller's known version.", openapi_api_url)
+                return SPEC_NOT_MODIFIED, None, known_validators
+
+            if response.status_code == 304 and cached:
+                logger.info("OpenAPI spec at %s not modified, using cached copy.", openapi_api_url)
+                _spec_cache.move_to_end(openapi_api_url)
+                return orjson.loads(cached[2]), cached[2], (cached[0], cached[1])
+
+            if response.status_code != 200:
+                await response.aread()
+                logger.error(
+                    "Failed to fetch OpenAPI spec from %s. Status code: %s. Response: %s...",
+                    openapi_api_url, response.status_code, response.text[:500]
+                )
+                return None, None, (None, None)
+
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                body.extend(chunk)
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+
+        # orjson parses the raw bytes directly, without decoding the body to str first
+        spec_content = orjson.loads(body)
+        logger.info("Successfully fetched and parsed OpenAPI spec from %s", openapi_api_url)
+        body_bytes = bytes(body)
+        if etag or last_modified:
+            _remember_spec_body(openapi_api_url, etag, last_modified, body_bytes)
+        else:
+            _spec_cache.pop(openapi_api_url, None)
+        return spec_content, body_bytes, (etag, last_modified)
+    except httpx.TimeoutException:
+        logger.error("Timeout occurred while trying to fetch OpenAPI spec from %s after %s seconds.", openapi_api_url, REQUEST_TIMEOUT_SECONDS)
+        return None, None, (None, None)
+    except httpx.RequestError as e:
+        logger.error("An error occurred during the request to %s. Error: %s", openapi_api_url, e)
+        return None, None, (None, None)
+    except orjson.JSONDecodeError as e:
+        logger.error("Failed to parse JSON from %s. Error: %s. Response text: %s...", openapi_api_url, e, body[:500].decode('utf-8', errors='replace'))
+        return None, None, (None, None)
+
+# Generations triggered close together for the same project share one download:
+# bodies fetched within the TTL are reused, and a fetch already in flight is awaited.
+# Entries are kept in fetch order, so expired ones are dropped from the front:
+# url -> (fetch time, body, (ETag, Last-Modified), body SHA-256)
+SPEC_FETCH_TTL_SECONDS = 10
+_recent_spec_bodies: "OrderedDict[str, Tuple[float, bytes, Tuple[Optional[str], Optional[str]], str]]" = OrderedDict()
+_inflight_spec_fetches: Dict[Tuple[str, Any], "asyncio.Future[Any]"] = {}
+
+def _evict_expired_spec_bodies(now: float) -> None:
+    while _recent_spec_bodies:
+        fetched_at = next(iter(_recent_spec_bodies.values()))[0]
+        if now - fetched_at < SPEC_FETCH_TTL_SECONDS:
+            break
+        _recent_spec_bodies.popitem(last=False)
+
+async def fetch_openapi_spec(openapi_api_url: str, known_validators: Optional[Tuple[Optional[str], Optional[str]]] = None
+                             ) -> Tuple[Any, Tuple[Optional[str], Optional[str]], Optional[str]]:
     """
     Fetches the OpenAPI specification from the given URL.
-    Returns the parsed JSON content as a dictionary, or None if an error occurs.
+    Returns (spec, validators, sha256): the parsed JSON content as a dictionary, or None if an error
+    occurs, together with the (ETag, Last-Modified) it was served with and the SHA-256 hex digest
+    of its body, so callers never have to look them up after the fact.
+    known_validators are the (ETag, Last-Modified) of a source version the caller already has a
+    result for; if the server confirms it is unchanged, SPEC_NOT_MODIFIED is returned instead.
+    Concurrent and closely repeated calls for the same URL are coalesced into one download;
+    every caller still gets its own freshly parsed dict, since callers mutate the spec.
     """
-    logger.info(f"Attempting to fetch OpenAPI spec from: {openapi_api_url}")
+    _evict_expired_spec_bodies(time.monotonic())
+    recent = _recent_spec_bodies.get(openapi_api_url)
+    if recent:
+        logger.info("Reusing OpenAPI spec fetched from %s less than %s seconds ago.", openapi_api_url, SPEC_FETCH_TTL_SECONDS)
+        _, body, validators, sha256 = recent
+        return orjson.loads(body), validators, sha256
+
+    # Only callers sending the same validators can share a fetch, since a 304 means something different for each
+    inflight_key = (openapi_api_url, known_validators)
+    inflight = _inflight_spec_fetches.get(inflight_key)
+    if inflight is not None:
+        logger.info("Waiting for the in-flight fetch of OpenAPI spec from %s.", openapi_api_url)
+        # shield: a cancelled waiter must not cancel the fetch other callers are waiting on
+        body, validators, sha256 = await asyncio.shield(inflight)
+        if body is None or body is SPEC_NOT_MODIFIED:
+            return body, validators, sha256
+        return orjson.loads(body), validators, sha256
 
+    future: "asyncio.Future[Any]" = asyncio.get_running_loop().create_future()
+    _inflight_spec_fetches[inflight_key] = future
+    # Waiters get the raw body (or the SPEC_NOT_MODIFIED sentinel) and parse their own copy
+    shared_result: Tuple[Any, Tuple[Optional[str], Optional[str]], Optional[str]] = (None, (None, None), None)
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(openapi_api_url, timeout=REQUEST_TIMEOUT_SECONDS)
-
-        if response.status_code == 200:
-            try:
-                spec_content = response.json()
-                logger.info(f"Successfully fetched and parsed OpenAPI spec from {openapi_api_url}")
-                return spec_content
-            except json.JSONDecodeError as e:
-                logger.error(f"Failed to parse JSON from {openapi_api_url}. Error: {e}. Response text: {response.text[:500]}...")
-                return None
+        spec_content, body, validators = await _download_openapi_spec(openapi_api_url, known_validators)
+        sha256 = hashlib.sha256(body).hexdigest() if body is not None else None
+        shared_result = (SPEC_NOT_MODIFIED if spec_content is SPEC_NOT_MODIFIED else body, validators, sha256)
+    finally:
+        del _inflight_spec_fetches[inflight_key]
+        future.set_result(shared_result)
+
+    if body is not None:
+        now = time.monotonic()
+        _evict_expired_spec_bodies(now)
+        _recent_spec_bodies[openapi_api_url] = (now, body, validators, sha256)
+        _recent_spec_bodies.move_to_end(openapi_api_url)
+    return spec_content, validators, sha256
+
+# Latest stored spec per project: project_id -> (doc id, spec), least recently used first.
+# Stored docs are never updated, so an entry is valid as long as its doc is still the latest one.
+# Cached specs are shared between generations and must only be read, never mutated.
+PREVIOUS_SPEC_CACHE_SIZE = 16
+_previous_spec_cache: "OrderedDict[int, Tuple[int, Dict[str, Any]]]" = OrderedDict()
+
+def _remember_previous_spec(project_id: int, doc_id: int, spec: Dict[str, Any]) -> None:
+    _previous_spec_cache[project_id] = (doc_id, spec)
+    _previous_spec_cache.move_to_end(project_id)
+    while len(_previous_spec_cache) > PREVIOUS_SPEC_CACHE_SIZE:
+        _previous_spec_cache.popitem(last=False)
+
+def _read_previous_spec_and_index(doc_id: int, cached: Optional[Tuple[int, Dict[str, Any]]]
+                                  ) -> Tuple[Optional[Dict[str, Any]], Optional[List[List[Any]]]]:
+    """
+    Reads the stored spec of the given doc and its descriptions index in one short-lived session.
+    The spec is only loaded and decompressed when the cached (doc id, spec) is for another doc.
+    Blocking; called through asyncio.to_thread.
+    """
+    with get_session_scope() as db:
+        if cached is not None and cached[0] == doc_id:
+            spec = cached[1]
         else:
-            logger.error(
-                f"Failed to fetch OpenAPI spec from {openapi_api_url}. "
-                f"Status code: {response.status_code}. Response: {response.text[:500]}..."
+            spec = crud_openapi_doc.get_openapi_spec_by_doc_id(db, doc_id)
+        if not spec:
+            return None, None
+        return spec, crud_openapi_doc.get_descriptions_index_by_doc_id(db, doc_id)
+
+
+def _mark_task_failed(task_id: int, error_message: str, result: str) -> None:
+    """
+    Marks only the task as failed, in a short-lived session of its own.
+    Blocking; called through asyncio.to_thread.
+    """
+    with get_session_scope() as db:
+        crud_task.update_task_status(db, task_id=task_id, status=TaskStatusEnum.failed,
+                                     error_message=error_message, result=result)
+
+
+def _mark_task_and_project_failed(task_id: int, project_id: int, error_message: str, result: str) -> None:
+    """
+    Marks the task and its project as failed in a single short-lived transaction.
+    Blocking; called through asyncio.to_thread.
+    """
+    with get_session_scope() as db:
+        crud_task.update_task_status(db, task_id=task_id, status=TaskStatusEnum.failed,
+                                     error_message=error_message, result=result, commit=False)
+        crud_project.update_project_status(db, project_id=project_id, status=ProjectStatusEnum.failed, commit=False)
+
+
+# Errors loading the project for update: exception type -> (log message, task error prefix, task result).
+# Checked in order; anything else is reported as unexpected.
+_PROJECT_FETCH_ERRORS = (
+    (ProjectLockedError, ("Failed to acquire lock for project %s during generation process: %s",
+                          "Project is locked by another process", _ERR_PROJECT_LOCKED)),
+    (OperationalError, ("Database operational error while fetching project %s for update: %s",
+                        "Database operational error", _ERR_PROJECT_DB)),
+)
+_PROJECT_FETCH_UNEXPECTED = ("An unexpected error occurred fetching project %s for update: %s",
+                             "Unexpected error fetching project", _ERR_PROJECT_UNEXPECTED)
+
+def _project_fetch_error(error: Exception) -> Tuple[str, str, str]:
+    for error_type, details in _PROJECT_FETCH_ERRORS:
+        if isinstance(error, error_type):
+            return details
+    return _PROJECT_FETCH_UNEXPECTED
+
+
+def _start_generation(project_id: int, task_id: int) -> Optional[ProjectModel]:
+    """
+    Marks the task as processing, locks and loads the project and marks it pending, all in one
+    short-lived session. Blocking; called through asyncio.to_thread.
+    Returns the detached project, or None if the task was marked failed instead.
+    """
+    with get_session_scope() as db:
+        # Update task status to processing right away
+        crud_task.update_task_status(db, task_id=task_id, status=TaskStatusEnum.processing)
+        logger.info("Task %s: Status updated to processing.", task_id)
+
+        try:
+            project = crud_project.get_project_for_update(db, project_id=project_id)
+        except Exception as e:
+            log_message, error_prefix, result = _project_fetch_error(e)
+            logger.error(log_message, project_id, e, exc_info=result is _ERR_PROJECT_UNEXPECTED)
+            crud_task.update_task_status(db, task_id=task_id, status=TaskStatusEnum.failed,
+                                         error_message=f"{error_prefix}: {str(e)}", result=result)
+            return None
+
+        if not project:
+            logger.error("Project with ID %s not found after lock attempt. Cannot initiate documentation generation.", project_id)
+            crud_task.update_task_status(
+                db,
+                task_id=task_id,
+                status=TaskStatusEnum.failed,
+                error_message=f"Project with ID {project_id} not found.",
+                result=_ERR_PROJECT_NOT_FOUND
             )
             return None
-    except httpx.TimeoutException:
-        logger.error(f"Timeout occurred while trying to fetch OpenAPI spec from {openapi_api_url} after {REQUEST_TIMEOUT_SECONDS} seconds.")
-        return None
-    except httpx.RequestError as e:
-        logger.error(f"An error occurred during the request to {openapi_api_url}. Error: {e}")
-        return None
-    except Exception as e:
-        logger.error(f"An unexpected error occurred while fetching OpenAPI spec from {openapi_api_url}. Error: {e}")
-        return None
 
-async def get_previous_spec(db: Session, project: ProjectModel) -> Optional[Dict[str, Any]]:
+        logger.info("Project '%s' (ID: %s) found. Source OpenAPI URL: %s", project.name, project.id, project.source_openapi_url)
+
+        if not project.source_openapi_url:
+            error_msg = f"Project '{project.name}' (ID: {project.id}) does not have a Source OpenAPI URL configured."
+            logger.error(error_msg)
+            crud_task.update_task_status(db, task_id=task_id, status=TaskStatusEnum.failed,
+                                         error_message=error_msg, result=_ERR_SOURCE_URL_MISSING)
+            # Also update project status to failed as it's a configuration issue
+            crud_project.update_project_status(db, project_id=project.id, status=ProjectStatusEnum.failed)
+            return None
+
+        # Update project status to 'pending' (meaning generation is in progress)
+        # This is distinct from task 'processing'. Project 'pending' means "Bella is working on it".
+        # The row is already locked and loaded, so it is updated in place and committed together
+        # with the lock release when the session scope exits
+        crud_project.set_loaded_project_status(db, project, ProjectStatusEnum.pending)
+        logger.info("Project %s status updated to 'pending'.", project.name)
+
+        # Keep the loaded project data usable after this session is closed
+        db.expunge(project)
+        return project
+
+
+def _store_generated_doc(project_id: int, task_id: int, openapi_spec: Dict[str, Any], descriptions_index: Optional[List[List[Any]]],
+                         source_validators: Tuple[Optional[str], Optional[str]], source_sha256: Optional[str]) -> int:
     """
-    Fetches the latest stored OpenAPI specification for the project from the database.
+    Stores the generated spec and marks the task successful and the project active.
+    The three writes are committed together when the session scope exits, so the task never
+    shows success without its doc. Returns the id of the stored doc.
+    If no descriptions index is given it is built here, before the session is opened, so the
+    walk over the whole spec stays off the event loop. Blocking; called through asyncio.to_thread.
     """
-    logger.info(f"Fetching latest stored OpenAPI spec for project: {project.name} (ID: {project.id})")
-    latest_doc = crud_openapi_doc.get_latest_openapi_doc_by_project_id(db, project_id=project.id)
-    
-    if latest_doc and latest_doc.openapi_spec:
-        logger.info(f"Successfully retrieved latest spec (Doc ID: {latest_doc.id}) for project {project.name}.")
-        # Assuming openapi_spec is already a dict. If it's a string, json.loads() would be needed.
-        # Given it's a JSON type in model, SQLAlchemy should handle this.
-        return latest_doc.openapi_spec 
+    if descriptions_index is None:
+        descriptions_index = build_descriptions_index(openapi_spec)
+    with get_session_scope() as db:
+        # Store the newly generated OpenAPI spec
+        db_doc = crud_openapi_doc.create_openapi_doc(db, project_id=project_id, task_id=task_id, openapi_spec=openapi_spec,
+                                                     descriptions_index=descriptions_index,
+                                                     source_etag=source_validators[0],
+                                                     source_last_modified=source_validators[1],
+                                                     source_sha256=source_sha256, commit=False)
+
+        # Final Status Updates
+        crud_task.update_task_status(db, task_id=task_id, status=TaskStatusEnum.success,
+                                     result=_RESULT_SUCCESS, commit=False)
+        crud_project.update_project_status(db, project_id=project_id, status=ProjectStatusEnum.active, commit=False) # Project is now active with new doc
+        doc_id = db_doc.id
+    logger.info("Task %s: Successfully stored newly generated OpenAPI spec in DB for project %s.", task_id, project_id)
+    return doc_id
+
+
+def _record_unexpected_failure(task_id: int, project: Optional[ProjectModel], error_message: str, result: str) -> None:
+    """
+    Records an unexpected orchestration error on the task, and on the project if it was loaded.
+    Uses a fresh session, since the one in use when the error happened may have been rolled back.
+    Blocking; called through asyncio.to_thread.
+    """
+    with get_session_scope() as db:
+        crud_task.update_task_status(db, task_id=task_id, status=TaskStatusEnum.failed,
+                                     error_message=error_message, result=result, commit=False)
+        # Optionally update project status to failed if it's not already
+        if project and project.status != ProjectStatusEnum.failed:
+            crud_project.update_project_status(db, project_id=project.id, status=ProjectStatusEnum.failed, commit=False)
+
+
+def _load_source_state(project_id: int) -> Tuple[Optional[int], Optional[Tuple[Optional[str], Optional[str]]], Optional[str]]:
+    """
+    Returns the id of the latest stored doc with the (ETag, Last-Modified) and the body SHA-256 of
+    the source spec behind it; any of them is None if unknown. Blocking; called through asyncio.to_thread.
+    """
+    with get_session_scope() as db:
+        return crud_openapi_doc.get_latest_source_state_by_project_id(db, project_id=project_id)
+
+
+async def _reuse_previous_doc(project: ProjectModel, task_id: int, previous_spec: Dict[str, Any],
+                              previous_descriptions_index: Optional[List[List[Any]]],
+                              source_validators: Tuple[Optional[str], Optional[str]], source_sha256: Optional[str]) -> None:
+    """
+    Completes a generation whose source is unchanged by storing the latest doc again for this task.
+    """
+    stored_doc_id = await asyncio.to_thread(_store_generated_doc, project.id, task_id, previous_spec,
+                                            previous_descriptions_index, source_validators, source_sha256)
+    _remember_previous_spec(project.id, stored_doc_id, previous_spec)
+    logger.info("Task %s: Orchestration completed successfully for project '%s'. Task status 'success', Project status 'active'.", task_id, project.name)
+
+
+async def _load_previous_spec_and_index(project: ProjectModel, doc_id: Optional[int]
+                                        ) -> Tuple[Optional[Dict[str, Any]], Optional[List[List[Any]]]]:
+    """
+    Loads the stored spec and descriptions index of the given doc, the project's latest one at the
+    time its source state was read. The session and the spec decompression run in a worker thread;
+    only the in-process cache is touched on the event loop.
+    """
+    if doc_id is None:
+        logger.info("No previous spec found in database for project %s.", project.name)
+        return None, None
+
+    logger.info("Fetching stored OpenAPI spec (Doc ID: %s) for project: %s (ID: %s)", doc_id, project.name, project.id)
+    cached = _previous_spec_cache.get(project.id)
+    previous_spec, previous_descriptions_index = await asyncio.to_thread(_read_previous_spec_and_index, doc_id, cached)
+    if previous_spec is None:
+        logger.info("No previous spec found in database for project %s.", project.name)
+        return None, None
+
+    if cached is not None and cached[0] == doc_id:
+        _previous_spec_cache.move_to_end(project.id)
+        logger.info("Using cached latest spec (Doc ID: %s) for project %s.", doc_id, project.name)
+    else:
+        logger.info("Successfully retrieved latest spec (Doc ID: %s) for project %s.", doc_id, project.name)
+        _remember_previous_spec(project.id, doc_id, previous_spec)
+    return previous_spec, previous_descriptions_index
+
+
+# Code-RAG repositories known to be indexed: (project name, git repo url) -> (head sha, time of setup).
+# A repository whose remote HEAD has not moved since its last successful setup is not set up again;
+# entries expire so an index lost on the Code-RAG side is eventually rebuilt.
+CODE_RAG_SETUP_CACHE_TTL_SECONDS = 3600
+_code_rag_setup_cache: Dict[Tuple[str, str], Tuple[str, float]] = {}
+
+async def _setup_code_rag_repository_if_needed(project: ProjectModel, apikey: str) -> Dict[str, Any]:
+    """
+    Sets up the project's Code-RAG repository and waits for it, unless the repository was already
+    set up at the current remote HEAD. If the HEAD cannot be resolved the setup always runs.
+    """
+    cache_key = (project.name, project.git_repo_url)
+    head_sha = await get_remote_head_sha(project.git_repo_url, project.git_auth_token)
+    cached = _code_rag_setup_cache.get(cache_key)
+    if head_sha and cached and cached[0] == head_sha and time.monotonic() - cached[1] < CODE_RAG_SETUP_CACHE_TTL_SECONDS:
+        logger.info("Code-RAG repository for project '%s' already set up at %s, skipping setup.", project.name, head_sha)
+        return {"status": "completed"}
+
+    setup_result = await setup_code_rag_repository_and_wait(
+        project_name=project.name,
+        git_repo_url=project.git_repo_url,
+        git_auth_token=project.git_auth_token,
+        apikey=apikey, # This is the project's bearer token passed to initiate_doc_generation_process
+        max_wait_time=1800,  # 等待最多30分钟
+        polling_interval=30   # 轮询间隔从1秒开始翻倍，最长30秒
+    )
+    if head_sha and setup_result.get("status") == "completed":
+        _code_rag_setup_cache[cache_key] = (head_sha, time.monotonic())
     else:
-        logger.info(f"No previous spec found in database for project {project.name}.")
-        return None
+        _code_rag_setup_cache.pop(cache_key, None)
+    return setup_result
+
+
+# One lock per project for the generations running in this process. Registration needs no
+# extra guard: lookup and insert happen without an await in between on the event loop.
+# An entry only lives while its project is being generated, so the registry stays bounded.
+_project_locks: Dict[int, asyncio.Lock] = {}
+
+def _get_project_lock(project_id: int) -> asyncio.Lock:
+    lock = _project_locks.get(project_id)
+    if lock is None:
+        lock = _project_locks[project_id] = asyncio.Lock()
+    return lock
 
 
 async def initiate_doc_generation_process(project_id: int, task_id: int, apikey: str): # Added task_id
     """
     Main orchestration function to generate documentation for a project.
     The apikey is the project's API token, potentially used for fetching its own source_openapi_url if protected.
+    A generation requested while another one for the same project is running in this process
+    fails fast, before any DB row lock is attempted.
     """
-    logger.info(f"Orchestration: Starting for project_id={project_id}, task_id={task_id}")
+    logger.info("Orchestration: Starting for project_id=%s, task_id=%s", project_id, task_id)
 
-    with get_session_scope() as db:
-        try:
-            # Update task status to processing right away
-            crud_task.update_task_status(db, task_id=task_id, status=TaskStatusEnum.processing)
-            logger.info(f"Task {task_id}: Status updated to processing.")
-
-            try:
-                project = crud_project.get_project_for_update(db, project_id=project_id)
-            except ProjectLockedError as ple:
-                logger.error(f"Failed to acquire lock for project {project_id} during generation process: {ple}")
-                crud_task.update_task_status(
-                    db,
-                    task_id=task_id,
-                    status=TaskStatusEnum.failed,
-                    error_message=f"Project is locked by another process: {str(ple)}", 
-                    result=json.dumps({"error": "Project is currently being processed by another request. Please try again later."})
-                )
-                return 
-            except OperationalError as oe: 
-                logger.error(f"Database operational error while fetching project {project_id} for update: {oe}")
-                crud_task.update_task_status(
-                    db,
-                    task_id=task_id,
-                    status=TaskStatusEnum.failed,
-                    error_message=f"Database operational error: {str(oe)}",
-                    result=json.dumps({"error": "A database error occurred while trying to access project details."})
-                )
-                return 
-            except Exception as e: 
-                logger.error(f"An unexpected error occurred fetching project {project_id} for update: {e}", exc_info=True)
-                crud_task.update_task_status(
-                    db,
-                    task_id=task_id,
-                    status=TaskStatusEnum.failed,
-                    error_message=f"Unexpected error fetching project: {str(e)}",
-                    result=json.dumps({"error": "An unexpected error occurred while retrieving project details."})
-                )
-                return 
-
-            if not project:
-                logger.error(f"Project with ID {project_id} not found after lock attempt. Cannot initiate documentation generation.")
-                crud_task.update_task_status(
-                    db,
-                    task_id=task_id,
-                    status=TaskStatusEnum.failed,
-                    error_message=f"Project with ID {project_id} not found.",
-                    result=json.dumps({"error": "Project not found."})
-                )
-                return 
+    project_lock = _get_project_lock(project_id)
+    if project_lock.locked():
+        logger.error("Project %s is already being processed in this process. Task %s will not run.", project_id, task_id)
+        await asyncio.to_thread(_mark_task_failed, task_id,
+                                f"Project is locked by another process: generation for project {project_id} already running.",
+                                _ERR_PROJECT_LOCKED)
+        return
 
-            logger.info(f"Project '{project.name}' (ID: {project.id}) found. Source OpenAPI URL: {project.source_openapi_url}")
+    try:
+        async with project_lock:
+            await _run_doc_generation(project_id, task_id, apikey)
+    finally:
+        # Nothing ever waits on the lock, since a busy project fails fast above, so once it is
+        # released the entry can go; the next generation for the project registers a new one
+        if not project_lock.locked() and _project_locks.get(project_id) is project_lock:
+            del _project_locks[project_id]
 
-            if not project.source_openapi_url:
-                error_msg = f"Project '{project.name}' (ID: {project.id}) does not have a Source OpenAPI URL configured."
-                logger.error(error_msg)
-                crud_task.update_task_status(db, task_id=task_id, status=TaskStatusEnum.failed,
-                                             error_message=error_msg, result=json.dumps({"error": "Source OpenAPI URL not configured"}))
-                # Also update project status to failed as it's a configuration issue
-                crud_project.update_project_status(db, project_id=project.id, status=ProjectStatusEnum.failed)
-                return
 
-            # Update project status to 'pending' (meaning generation is in progress)
-            # This is distinct from task 'processing'. Project 'pending' means "Bella is working on it".
-            crud_project.update_project_status(db, project_id=project.id, status=ProjectStatusEnum.pending)
-            logger.info(f"Project {project.name} status updated to 'pending'.")
+async def _run_doc_generation(project_id: int, task_id: int, apikey: str):
+    """
+    Runs one documentation generation; see initiate_doc_generation_process.
+    """
 
-            # Fetch User's Source Spec (potentially using the project's API key if the URL is protected)
-            openapi_spec_source = await fetch_openapi_spec(project.source_openapi_url)
-            if openapi_spec_source is None:
-                error_msg = f"Failed to fetch source OpenAPI spec for project '{project.name}' from {project.source_openapi_url}."
-                logger.error(error_msg)
-                crud_task.update_task_status(db, task_id=task_id, status=TaskStatusEnum.failed,
-                                             error_message=error_msg, result=json.dumps({"error": "Failed to fetch source OpenAPI spec"}))
-                crud_project.update_project_status(db, project_id=project.id, status=ProjectStatusEnum.failed)
+    project: Optional[ProjectModel] = None
+    code_rag_setup_task: Optional[asyncio.Task] = None
+    try:
+        # Task/project status updates and the project lock run in a worker thread with their own session
+        project = await asyncio.to_thread(_start_generation, project_id, task_id)
+        if project is None:
+            return
+
+        # Validators and body digest of the source the latest stored doc was generated from: if the
+        # server answers the validators with 304, or sends the same body again, that doc is still
+        # up to date and the generation can reuse it as is. The previous spec and index are then
+        # loaded for that same doc id, so they always match this source state.
+        previous_doc_id, known_validators, known_source_sha256 = await asyncio.to_thread(_load_source_state, project.id)
+
+        # Fetch User's Source Spec (potentially using the project's API key if the URL is protected)
+        # and Bella's Stored/Previous Spec from our DB concurrently, they are independent
+        (openapi_spec_source, source_validators, source_sha256), (previous_spec, previous_descriptions_index) = await asyncio.gather(
+            fetch_openapi_spec(project.source_openapi_url, known_validators),
+            _load_previous_spec_and_index(project, previous_doc_id)
+        )
+        if openapi_spec_source is SPEC_NOT_MODIFIED:
+            if previous_spec is not None:
+                logger.info("Task %s: Source spec unchanged since the latest stored doc for project '%s', reusing it.", task_id, project.name)
+                await _reuse_previous_doc(project, task_id, previous_spec, previous_descriptions_index,
+                                          known_validators, known_source_sha256)
                 return
-            logger.info(f"Task {task_id}: Successfully fetched source OpenAPI spec for project '{project.name}'.")
+            # The stored doc disappeared in between; fall back to a plain fetch
+            openapi_spec_source, source_validators, source_sha256 = await fetch_openapi_spec(project.source_openapi_url)
+        if openapi_spec_source is None:
+            error_msg = f"Failed to fetch source OpenAPI spec for project '{project.name}' from {project.source_openapi_url}."
+            logger.error(error_msg)
+            await asyncio.to_thread(_mark_task_and_project_failed, task_id, project.id, error_msg, _ERR_FETCH_FAILED)
+            return
+        logger.info("Task %s: Successfully fetched source OpenAPI spec for project '%s'.", task_id, project.name)
+
+        # Same body as the source of the latest stored doc: merge, diff and description completion
+        # would all be no-ops, so the stored doc is reused directly
+        if previous_spec is not None and source_sha256 is not None and source_sha256 == known_source_sha256:
+            logger.info("Task %s: Source spec content unchanged since the latest stored doc for project '%s', reusing it.", task_id, project.name)
+            await _reuse_previous_doc(project, task_id, previous_spec, previous_descriptions_index,
+                                      source_validators, source_sha256)
+            return
 
-            # Fetch Bella's Stored/Previous Spec from our DB
-            previous_spec = await get_previous_spec(db, project) # This is now from crud_openapi_doc
-            if previous_spec is None:
-                logger.info(f"Task {task_id}: No previous spec found for project '{project.name}'. Assuming first run or unable to retrieve.")
+        # Code-RAG repository setup only needs the project's git settings, so it runs in the
+        # background while the specs are merged and diffed; its result is awaited later. It is only
+        # started once the source is known to have changed: a setup request sent for an unchanged
+        # source would clone and index the repository for nothing, since cancelling the task only
+        # stops the local wait
+        logger.info("Task %s: Initiating Code-RAG repository setup for project '%s' in the background.", task_id, project.name)
+        code_rag_setup_task = asyncio.create_task(_setup_code_rag_repository_if_needed(project, apikey))
+
+        if previous_spec is None:
+            logger.info("Task %s: No previous spec found for project '%s'. Assuming first run or unable to retrieve.", task_id, project.name)
+        else:
+            logger.info("Task %s: Successfully fetched previous spec for project '%s'", task_id, project.name)
+            
+            # 在进行diff前，把previous_spec中的description合并到openapi_spec_source
+            logger.info("Task %s: Merging descriptions from previous spec into source spec before calculating diff.", task_id)
+            if previous_descriptions_index is not None:
+                openapi_spec_source = await asyncio.to_thread(apply_descriptions_index, openapi_spec_source, previous_descriptions_index)
             else:
-                logger.info(f"Task {task_id}: Successfully fetched previous spec for project '{project.name}'")
-                
-                # 在进行diff前，把previous_spec中的description合并到openapi_spec_source
-                logger.info(f"Task {task_id}: Merging descriptions from previous spec into source spec before calculating diff.")
-                openapi_spec_source = merge_descriptions(previous_spec, openapi_spec_source)
-                logger.info(f"Task {task_id}: Merged descriptions from previous spec into source spec.")
+                # 旧文档没有预先生成的索引，退回到完整遍历
+                openapi_spec_source = await asyncio.to_thread(merge_descriptions, previous_spec, openapi_spec_source)
+            logger.info("Task %s: Merged descriptions from previous spec into source spec.", task_id)
 
-            # Perform Real Diff
-            spec_diff_report = calculate_spec_diff(previous_spec, openapi_spec_source)
-            diff_summary = {k: len(v) if isinstance(v, (list, dict)) else v for k, v in spec_diff_report.items()} # Summarize counts
-            logger.info(f"Task {task_id}: Spec diff report summary: {diff_summary}")
-            logger.debug(f"Task {task_id}: Full spec_diff_report: {spec_diff_report}")
+        # Perform Real Diff; the merge above and the diff are CPU-bound dict walks, so they
+        # run in a worker thread to keep the event loop responsive on large specs
+        spec_diff_report = await asyncio.to_thread(calculate_spec_diff, previous_spec, openapi_spec_source)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Task %s: Spec diff report summary: %s", task_id, summarize_spec_diff(spec_diff_report))
+        # The full report can be megabytes; make sure it is only rendered when debug logging is on
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Task %s: Full spec_diff_report: %s", task_id, spec_diff_report)
 
 
+        if not spec_diff_report["added_paths"] and not spec_diff_report["modified_paths"]:
+            # Nothing for the LLM to describe: generate_descriptions would return the source spec
+            # unchanged, so skip waiting for Code-RAG and reuse the merged source spec directly.
+            # The setup overlaps the merge and diff, so its request may already have been sent;
+            # cancelling only stops waiting for it
+            logger.info("Task %s: No added or modified paths, skipping the wait for Code-RAG setup and description completion.", task_id)
+            code_rag_setup_task.cancel()
+            newly_generated_spec = openapi_spec_source
+        else:
             # Targeted Description Completion (Demo)
-            logger.info(f"Task {task_id}: Initiating targeted description completion (demo)...")
+            logger.info("Task %s: Initiating targeted description completion (demo)...", task_id)
             # Conceptual LLM input based on diff (summary of keys/items)
-            llm_input_summary = {
-                "added_paths": list(spec_diff_report["added_paths"].keys()),
-                "modified_paths_new_keys": list(spec_diff_report["modified_paths"].keys()), 
-                "added_schemas": list(spec_diff_report["added_components_schemas"].keys()),
-                "modified_schemas_new_keys": list(spec_diff_report["modified_components_schemas"].keys()) 
-            }
-            logger.info(f"Task {task_id}: Conceptual LLM input summary (keys): {llm_input_summary}")
-
-            # Call Code-RAG Service to setup repository and wait for completion
-            logger.info(f"Task {task_id}: Initiating Code-RAG repository setup for project '{project.name}' and waiting for completion.")
-            code_rag_setup_result = await setup_code_rag_repository_and_wait(
-                project_name=project.name,
-                git_repo_url=project.git_repo_url,
-                git_auth_token=project.git_auth_token,
-                apikey=apikey, # This is the project's bearer token passed to initiate_doc_generation_process
-                max_wait_time=1800,  # 等待最多30分钟
-                polling_interval=10   # 每10秒检查一次
-            )
+            if logger.isEnabledFor(logging.INFO):
+                llm_input_summary = {
+                    "added_paths": spec_diff_report["added_paths_keys"],
+                    "modified_paths_new_keys": spec_diff_report["modified_paths_keys"],
+                    "added_schemas": spec_diff_report["added_components_schemas_keys"],
+                    "modified_schemas_new_keys": spec_diff_report["modified_components_schemas_keys"]
+                }
+                logger.info("Task %s: Conceptual LLM input summary (keys): %s", task_id, llm_input_summary)
+
+            # Wait for the Code-RAG repository setup started above
+            logger.info("Task %s: Waiting for Code-RAG repository setup for project '%s' to complete.", task_id, project.name)
+            code_rag_setup_result = await code_rag_setup_task
 
             # 检查是否发生错误或者状态不是completed
             if code_rag_setup_result.get("status") != "completed":
                 error_msg = f"Task {task_id}: Code-RAG repository setup failed for project '{project.name}'. See previous logs for details."
                 logger.error(error_msg)
                 # Update task and project status to failed
-                crud_task.update_task_status(db, task_id=task_id, status=TaskStatusEnum.failed,
-                                             error_message=error_msg, result=json.dumps({"error": "Code-RAG setup failed."}))
-                crud_project.update_project_status(db, project_id=project.id, status=ProjectStatusEnum.failed)
+                await asyncio.to_thread(_mark_task_and_project_failed, task_id, project.id, error_msg, _ERR_CODE_RAG_SETUP_FAILED)
                 return # Exit the generation process
 
-            logger.info(f"Task {task_id}: Code-RAG repository setup successful for project '{project.name}'.")
+            logger.info("Task %s: Code-RAG repository setup successful for project '%s'.", task_id, project.name)
 
             # Targeted Description Completion
-            logger.info(f"Task {task_id}: Initiating targeted description completion...")
+            logger.info("Task %s: Initiating targeted description completion...", task_id)
             # spec_diff_report is available from previous steps
-            newly_generated_spec = await generate_descriptions(openapi_spec_source=openapi_spec_source, spec_diff_report=spec_diff_report, repo_id=project.name, language=project.language, apikey=apikey)
-            logger.info(f"Task {task_id}: Targeted description completion finished.")
-
-            # Merge Changes (Placeholder)
-            logger.info(f"Task {task_id}: Merging changes (placeholder)...")
-            # Actual merge logic would use spec_diff_report and newly_generated_spec parts.
-            # For now, newly_generated_spec (which is currently the full source spec + demo changes) is used.
-            final_openapi_spec = newly_generated_spec # This will be saved
-            logger.info(f"Task {task_id}: Merging changes (placeholder) complete.")
-
-            # Store the newly generated OpenAPI spec
-            crud_openapi_doc.create_openapi_doc(db, project_id=project.id, task_id=task_id, openapi_spec=final_openapi_spec)
-            logger.info(f"Task {task_id}: Successfully stored newly generated OpenAPI spec in DB for project {project.id}.")
-
-            # Final Status Updates
-            crud_task.update_task_status(db, task_id=task_id, status=TaskStatusEnum.success,
-                                         result=json.dumps({"message": "OpenAPI documentation generated and stored successfully."}))
-            crud_project.update_project_status(db, project_id=project.id, status=ProjectStatusEnum.active) # Project is now active with new doc
-            logger.info(f"Task {task_id}: Orchestration completed successfully for project '{project.name}'. Task status 'success', Project status 'active'.")
+            newly_generated_spec = await generate_descriptions(openapi_spec_source=openapi_spec_source, spec_diff_report=spec_diff_report, repo_id=project.name, language=project.language, apikey=apikey,
+                                                         max_concurrency=settings.CODE_RAG_MAX_CONCURRENCY)
+            logger.info("Task %s: Targeted description completion finished.", task_id)
 
-        except Exception as e:
-            # Catch-all for any unexpected errors during the process
-            error_msg_detail = f"An unexpected error occurred during documentation generation for project {project_id}, task {task_id}: {str(e)}"
-            logger.error(error_msg_detail, exc_info=True) # Log traceback
-            
-            # Ensure session is active before trying to update task status
-            if db.is_active:
-                try:
-                    crud_task.update_task_status(db, task_id=task_id, status=TaskStatusEnum.failed,
-                                                 error_message=error_msg_detail, 
-                                                 result=json.dumps({"error": "An unexpected server error occurred.", "details": str(e)}))
-                    # Optionally update project status to failed if it's not already
-                    if project and project.status != ProjectStatusEnum.failed:
-                         crud_project.update_project_status(db, project_id=project.id, status=ProjectStatusEnum.failed)
-                except Exception as db_error: # If updating status itself fails
-                    logger.error(f"Failed to update task/project status to failed after unexpected error. DB Error: {db_error}", exc_info=True)
-            return # Exit function
+        # Merge Changes (Placeholder)
+        logger.info("Task %s: Merging changes (placeholder)...", task_id)
+        # Actual merge logic would use spec_diff_report and newly_generated_spec parts.
+        # For now, newly_generated_spec (which is currently the full source spec + demo changes) is used.
+        final_openapi_spec = newly_generated_spec # This will be saved
+        logger.info("Task %s: Merging changes (placeholder) complete.", task_id)
+
+        # The descriptions index for the next generation is built in the worker thread as well
+        stored_doc_id = await asyncio.to_thread(_store_generated_doc, project.id, task_id, final_openapi_spec, None,
+                                                source_validators, source_sha256)
+        # The next generation for this project starts from this spec; keep it so it is not reloaded from the DB
+        _remember_previous_spec(project.id, stored_doc_id, final_openapi_spec)
+        logger.info("Task %s: Orchestration completed successfully for project '%s'. Task status 'success', Project status 'active'.", task_id, project.name)
+
+    except Exception as e:
+        # Catch-all for any unexpected errors during the process
+        error_msg_detail = f"An unexpected error occurred during documentation generation for project {project_id}, task {task_id}: {str(e)}"
+        logger.error(error_msg_detail, exc_info=True) # Log traceback
+
+        # Do not leave the background Code-RAG setup wait running for a failed generation
+        if code_rag_setup_task is not None:
+            code_rag_setup_task.cancel()
+
+        try:
+            await asyncio.to_thread(_record_unexpected_failure, task_id, project, error_msg_detail,
+                                    f'{_ERR_UNEXPECTED_PREFIX}{orjson.dumps(str(e)).decode()}}}')
+        except Exception as db_error: # If updating status itself fails
+            logger.error("Failed to update task/project status to failed after unexpected error. DB Error: %s", db_error, exc_info=True)
+        return # Exit function
@@ -30,4 +30,18 @@ SHOW VARIABLES LIKE 'read_buffer_size';
 SHOW VARIABLES LIKE 'innodb_buffer_pool_size';
 
 -- 7. 查看表结构确认索引已添加
-SHOW INDEX FROM openapi_docs;
\ No newline at end of file
+SHOW INDEX FROM openapi_docs;
+
+-- 8. 为已有的 openapi_docs 表添加 description 索引列（旧数据为 NULL，合并时会退回到完整遍历）
+ALTER TABLE openapi_docs ADD COLUMN descriptions_index JSON NULL;
+
+-- 9. 新文档的spec以zstd压缩后存入 openapi_spec_zstd，openapi_spec 仅保留给旧数据，因此改为可空
+ALTER TABLE openapi_docs ADD COLUMN openapi_spec_zstd LONGBLOB NULL;
+ALTER TABLE openapi_docs MODIFY COLUMN openapi_spec JSON NULL;
+
+-- 10. 记录生成文档时源spec的ETag/Last-Modified，下次生成时做条件请求，源未变化时直接复用文档
+ALTER TABLE openapi_docs ADD COLUMN source_etag VARCHAR(255) NULL;
+ALTER TABLE openapi_docs ADD COLUMN source_last_modified VARCHAR(64) NULL;
+
+-- 11. 记录生成文档时源spec内容的SHA-256，源不支持条件请求时，内容未变化也能直接复用文档
+ALTER TABLE openapi_docs ADD COLUMN source_sha256 CHAR(64) NULL;
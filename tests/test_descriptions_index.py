@@ -0,0 +1,45 @@
+import copy
+
+from app.services.orchestration_service import (
+    apply_descriptions_index,
+    build_descriptions_index,
+    merge_descriptions,
+)
+
+
+def _spec(parameters):
+    return {
+        "openapi": "3.0.0",
+        "paths": {"/v1/items": {"get": {"parameters": parameters, "responses": {"200": {"description": "OK"}}}}},
+    }
+
+
+def test_same_name_parameters_all_get_the_stored_description():
+    previous_spec = _spec([
+        {"name": "id", "in": "query", "description": "Item id"},
+        {"name": "id", "in": "header"},
+    ])
+    current_spec = _spec([
+        {"name": "id", "in": "query"},
+        {"name": "id", "in": "header"},
+    ])
+
+    merged = merge_descriptions(previous_spec, copy.deepcopy(current_spec))
+    applied = apply_descriptions_index(copy.deepcopy(current_spec), build_descriptions_index(previous_spec))
+
+    assert applied == merged
+    assert [p.get("description") for p in applied["paths"]["/v1/items"]["get"]["parameters"]] == ["Item id", "Item id"]
+
+
+def test_existing_parameter_description_is_kept():
+    previous_spec = _spec([{"name": "id", "in": "query", "description": "Item id"}])
+    current_spec = _spec([
+        {"name": "id", "in": "query", "description": "Kept"},
+        {"name": "id", "in": "header"},
+    ])
+
+    merged = merge_descriptions(previous_spec, copy.deepcopy(current_spec))
+    applied = apply_descriptions_index(copy.deepcopy(current_spec), build_descriptions_index(previous_spec))
+
+    assert applied == merged
+    assert [p.get("description") for p in applied["paths"]["/v1/items"]["get"]["parameters"]] == ["Kept", "Item id"]